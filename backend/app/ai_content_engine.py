@@ -7,7 +7,11 @@ import os
 import logging
 import asyncio
 import re
+import time
+import hashlib
 from typing import Dict, List, Optional
+import httpx
+import orjson
 from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
@@ -16,10 +20,54 @@ logger = logging.getLogger(__name__)
 class ViralContentEngine:
     """Generate viral social media content using OpenAI GPT-4"""
     
-    def __init__(self):
+    # Upper bound on in-flight OpenAI requests across all batches
+    MAX_CONCURRENT_REQUESTS = 4
+    # Generated posts are reused until the property data they were built from changes
+    CACHE_TTL = 24 * 3600  # seconds
+    CACHE_SIZE = 1024
+    
+    BASE_PROMPT = """You are a viral real estate social media expert who creates engaging, high-converting content that stops scrollers and generates massive engagement. You understand platform algorithms, trending formats, and psychology of viral content."""
+    
+    PLATFORM_PROMPTS = {
+        "instagram": """Focus on:
+- Visual storytelling and aspirational language
+- 3-5 key highlights in first sentence
+- Emoji usage (2-3 relevant ones)
+- Call-to-action that encourages saves/shares
+- 20-30 strategic hashtags mixing popular and niche
+- Engaging question at the end""",
+        
+        "tiktok": """Focus on:
+- Hook in first 3 words that creates curiosity
+- Conversational, energetic tone
+- Pattern interrupts and unexpected reveals
+- Trending audio/format suggestions
+- 5-8 viral hashtags
+- Challenge or trend integration ideas""",
+        
+        "facebook": """Focus on:
+- Storytelling that evokes emotion
+- Longer, detailed narrative
+- Community engagement prompts
+- Local area highlights
+- 8-12 relevant hashtags
+- Questions that spark conversations""",
+        
+        "twitter": """Focus on:
+- Punchy, attention-grabbing opening
+- Maximum impact in limited characters
+- Thread-worthy insights
+- 3-5 targeted hashtags
+- Engagement-driving hooks"""
+    }
+    
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        self._request_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        self._cache: Dict[str, tuple] = {}
+        self.model = os.environ.get('OPENAI_CONTENT_MODEL', 'gpt-4o-mini')
         self.api_key = os.environ.get('OPENAI_API_KEY')
         if self.api_key and self.api_key != 'demo-key-for-testing':
-            self.client = AsyncOpenAI(api_key=self.api_key)
+            self.client = AsyncOpenAI(api_key=self.api_key, http_client=http_client)
             self.enabled = True
         else:
             self.client = None
@@ -32,67 +80,53 @@ class ViralContentEngine:
         if not self.enabled:
             return self._generate_fallback_content(property_data, platform, content_type)
         
+        key = self._cache_key(property_data, platform, content_type)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return dict(cached[1])
+        
         try:
             prompt = self._create_platform_prompt(property_data, platform, content_type)
             
-            response = await self.client.chat.completions.create(
-            model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": self._get_system_prompt(platform, content_type)},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=800,
-                temperature=0.85,
-                presence_penalty=0.6,
-                frequency_penalty=0.3
-            )
+            async with self._request_semaphore:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self._get_system_prompt(platform, content_type)},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=800,
+                    temperature=0.85,
+                    presence_penalty=0.6,
+                    frequency_penalty=0.3
+                )
             
             content_text = response.choices[0].message.content
-            return self._parse_ai_response(content_text, platform, content_type, property_data)
+            result = self._parse_ai_response(content_text, platform, content_type, property_data)
+            self._remember(key, result)
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Error generating AI content: {e}")
             return self._generate_fallback_content(property_data, platform, content_type)
     
+    def _remember(self, key: str, result: Dict):
+        """Store a generated post, evicting the oldest entry when full"""
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[key] = (time.monotonic() + self.CACHE_TTL, result)
+    
+    @staticmethod
+    def _cache_key(property_data: Dict, platform: str, content_type: str) -> str:
+        """Hash the listing content, not its id, so edits produce a fresh key"""
+        content = {k: v for k, v in property_data.items() if k != 'id'}
+        digest = hashlib.sha1(orjson.dumps(content, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        return f"viral:{platform}:{content_type}:{digest}"
+    
     def _get_system_prompt(self, platform: str, content_type: str) -> str:
         """Get system prompt based on platform and content type"""
         
-        base_prompt = """You are a viral real estate social media expert who creates engaging, high-converting content that stops scrollers and generates massive engagement. You understand platform algorithms, trending formats, and psychology of viral content."""
-        
-        platform_prompts = {
-            "instagram": """Focus on:
-- Visual storytelling and aspirational language
-- 3-5 key highlights in first sentence
-- Emoji usage (2-3 relevant ones)
-- Call-to-action that encourages saves/shares
-- 20-30 strategic hashtags mixing popular and niche
-- Engaging question at the end""",
-            
-            "tiktok": """Focus on:
-- Hook in first 3 words that creates curiosity
-- Conversational, energetic tone
-- Pattern interrupts and unexpected reveals
-- Trending audio/format suggestions
-- 5-8 viral hashtags
-- Challenge or trend integration ideas""",
-            
-            "facebook": """Focus on:
-- Storytelling that evokes emotion
-- Longer, detailed narrative
-- Community engagement prompts
-- Local area highlights
-- 8-12 relevant hashtags
-- Questions that spark conversations""",
-            
-            "twitter": """Focus on:
-- Punchy, attention-grabbing opening
-- Maximum impact in limited characters
-- Thread-worthy insights
-- 3-5 targeted hashtags
-- Engagement-driving hooks"""
-        }
-        
-        return f"{base_prompt}\n\n{platform_prompts.get(platform, '')}"
+        return f"{self.BASE_PROMPT}\n\n{self.PLATFORM_PROMPTS.get(platform, '')}"
     
     def _create_platform_prompt(self, property_data: Dict, platform: str, content_type: str) -> str:
         """Create detailed prompt for AI generation"""
@@ -278,24 +312,82 @@ What's your favorite feature? 👇
             'ai_generated': False
         }
     
+    async def _generate_combined(self, property_data: Dict, platforms: List[str]) -> Dict[str, Dict]:
+        """Generate captions for several platforms in one JSON-mode request"""
+        
+        content_dict = {}
+        misses = []
+        for platform in platforms:
+            cached = self._cache.get(self._cache_key(property_data, platform, "caption"))
+            if cached and cached[0] > time.monotonic():
+                content_dict[platform] = dict(cached[1])
+            else:
+                misses.append(platform)
+        
+        # A single miss is no cheaper combined; leave it to generate_viral_content
+        if len(misses) < 2:
+            return content_dict
+        
+        system_prompt = self.BASE_PROMPT + "".join(
+            f"\n\n{platform.upper()}:\n{self.PLATFORM_PROMPTS.get(platform, '')}" for platform in misses
+        )
+        prompt = (
+            self._create_platform_prompt(property_data, ", ".join(misses), "caption")
+            + f"\n\nReturn a JSON object with the keys {', '.join(misses)}; "
+            "each value is the complete post text for that platform."
+        )
+        
+        try:
+            async with self._request_semaphore:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=800 * len(misses),
+                    temperature=0.85,
+                    presence_penalty=0.6,
+                    frequency_penalty=0.3
+                )
+            posts = orjson.loads(response.choices[0].message.content)
+        except Exception as e:
+            logger.error(f"Combined content generation failed, falling back per platform: {e}")
+            return content_dict
+        
+        for platform in misses:
+            text = posts.get(platform) if isinstance(posts, dict) else None
+            if isinstance(text, str) and text.strip():
+                result = self._parse_ai_response(text, platform, "caption", property_data)
+                self._remember(self._cache_key(property_data, platform, "caption"), result)
+                content_dict[platform] = dict(result)
+        
+        return content_dict
+    
     async def generate_batch_content(self, property_data: Dict, platforms: List[str] = None, voice: str = "professional_female") -> Dict[str, Dict]:
-        """Generate content for multiple platforms simultaneously"""
+        """Generate content for multiple platforms, in one request where possible"""
         
         if platforms is None:
             platforms = ['instagram', 'tiktok', 'facebook', 'twitter']
         
-        tasks = [self.generate_viral_content(property_data, platform, voice=voice) for platform in platforms]
+        content_dict = {}
+        if self.enabled and len(platforms) > 1:
+            content_dict = await self._generate_combined(property_data, platforms)
+        
+        # Anything the combined request did not cover goes through the per-platform path
+        remaining = [platform for platform in platforms if platform not in content_dict]
+        tasks = [self.generate_viral_content(property_data, platform, voice=voice) for platform in remaining]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
-        content_dict = {}
-        for platform, result in zip(platforms, results):
+        for platform, result in zip(remaining, results):
             if isinstance(result, Exception):
                 logger.error(f"Error generating content for {platform}: {result}")
                 content_dict[platform] = self._generate_fallback_content(property_data, platform, "caption")
             else:
                 content_dict[platform] = result
         
-        return content_dict
+        return {platform: content_dict[platform] for platform in platforms}
     
     async def optimize_content(self, content: str, platform: str, optimization_goal: str = "engagement") -> Dict:
         """Optimize existing content for better performance"""
@@ -319,7 +411,7 @@ INSTRUCTIONS:
 Provide ONLY the optimized content, no explanations."""
             
             response = await self.client.chat.completions.create(
-                model="gpt-4o",
+                model=self.model,
                 messages=[
                     {"role": "system", "content": "You are a social media optimization expert."},
                     {"role": "user", "content": prompt}
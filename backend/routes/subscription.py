@@ -1,44 +1,30 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Request
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
-import aiosqlite
 import logging
-from pathlib import Path
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-DATABASE_PATH = Path(__file__).parent.parent / "listingspark.db"
-
 class SubscriptionSave(BaseModel):
     subscription_id: str
     plan_type: str
     status: str = "active"
 
 @router.post("/save")
-async def save_subscription(subscription: SubscriptionSave, authorization: Optional[str] = Header(None)):
+async def save_subscription(
+    subscription: SubscriptionSave,
+    request: Request,
+    authorization: Optional[str] = Header(None)
+):
     """Save PayPal subscription details to user account"""
     try:
         # For now, we'll use email from the subscription or a basic auth
         # You can enhance this with proper JWT token parsing later
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Create subscription column if it doesn't exist
-            try:
-                await db.execute("""
-                    ALTER TABLE users ADD COLUMN subscription_id TEXT
-                """)
-                await db.execute("""
-                    ALTER TABLE users ADD COLUMN subscription_plan TEXT
-                """)
-                await db.execute("""
-                    ALTER TABLE users ADD COLUMN subscription_status TEXT
-                """)
-                await db.commit()
-            except:
-                pass  # Column already exists
-            
+        # Subscription columns are added by the startup migration in init_db
+        async with request.app.state.pool.writer() as db:
             # For demo, update the most recent user
             # In production, you'd parse the JWT token from authorization header
             await db.execute("""
@@ -49,8 +35,6 @@ async def save_subscription(subscription: SubscriptionSave, authorization: Optio
                     plan = ?
                 WHERE id = (SELECT id FROM users ORDER BY created_at DESC LIMIT 1)
             """, (subscription.subscription_id, subscription.plan_type, subscription.status, subscription.plan_type))
-            
-            await db.commit()
         
         logger.info(f"Subscription saved: {subscription.subscription_id}")
         
@@ -65,29 +49,24 @@ async def save_subscription(subscription: SubscriptionSave, authorization: Optio
         raise HTTPException(status_code=500, detail=f"Failed to save subscription: {str(e)}")
 
 @router.get("/status")
-async def get_subscription_status(authorization: Optional[str] = Header(None)):
+async def get_subscription_status(request: Request, authorization: Optional[str] = Header(None)):
     """Get subscription status"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with request.app.state.pool.reader() as db:
             async with db.execute("""
-                SELECT subscription_id, subscription_plan, subscription_status 
+                SELECT subscription_id, subscription_plan AS plan_type, subscription_status AS status
                 FROM users 
                 ORDER BY created_at DESC LIMIT 1
             """) as cursor:
                 row = await cursor.fetchone()
                 
-                if not row or not row[0]:
+                if not row or not row['subscription_id']:
                     return {
                         "has_subscription": False,
                         "plan_type": None
                     }
                 
-                return {
-                    "has_subscription": True,
-                    "subscription_id": row[0],
-                    "plan_type": row[1],
-                    "status": row[2]
-                }
+                return {"has_subscription": True, **dict(row)}
         
     except Exception as e:
         logger.error(f"Error fetching subscription: {str(e)}")
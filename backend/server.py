@@ -1,24 +1,35 @@
+import io
 import os
-import json
+import time
+import string
+import struct
+import asyncio
 import uuid
+import shutil
+import subprocess
+import hashlib
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Literal, Optional
+from collections import Counter
 from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 import aiosqlite
+import orjson
 from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks, Body, Form
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks, Body, Form, Depends, Request
 from platform_integrations import platform_manager, ListingData, ListingStatus
 from pydantic import BaseModel
 from app.ai_content_engine import ViralContentEngine
 import uuid
-import json
+import httpx
 from openai import AsyncOpenAI
-from PIL import Image
+from PIL import Image, features as pil_features
+import PIL
 from elevenlabs_voice import elevenlabs_engine
 from ai_image_enhancer import ai_enhancer
 from dotenv import load_dotenv
@@ -26,6 +37,15 @@ load_dotenv()
 from video_tour_generator_pro import premium_video_generator, VideoConfig, BrandingConfig
 from payment import router as payment_router
 from routes import subscription
+
+try:
+    import mozjpeg_lossless_optimization
+except ImportError:  # optional: falls back to Pillow's Huffman optimization
+    mozjpeg_lossless_optimization = None
+
+# Optional: strips metadata and writes progressive scans when installed on the host
+JPEGOPTIM = shutil.which("jpegoptim")
+
 # Configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,13 +54,26 @@ ROOT_DIR = Path(__file__).parent
 DATABASE_PATH = ROOT_DIR / "listingspark.db"
 UPLOADS_DIR = ROOT_DIR / "uploads"
 TOURS_DIR = ROOT_DIR / "tours"
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+MAX_UPLOAD_BYTES = 100 << 20  # 100 MB, well above a 16K equirectangular JPEG
+
+# Uvicorn workers; each builds its own executor and caches, so default to one process
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# PIL decoding and resampling is CPU-bound; keep it out of the event loop and
+# split the cores between workers
+IMAGE_EXECUTOR = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) // WEB_WORKERS))
 
 UPLOADS_DIR.mkdir(exist_ok=True)
 TOURS_DIR.mkdir(exist_ok=True)
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# One keep-alive pool shared by every OpenAI client so TLS sessions are reused
+OPENAI_HTTP = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=50, keepalive_expiry=60)
+)
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=OPENAI_HTTP)
 # Initialize AI Content Engine
-viral_content_engine = ViralContentEngine()
+viral_content_engine = ViralContentEngine(http_client=OPENAI_HTTP)
 
 # Professional Space Types for Real Estate
 SPACE_TYPES = {
@@ -136,6 +169,13 @@ STANDARD_AMENITIES = {
     ]
 }
 
+# Static catalogues are encoded once and served as-is
+SPACE_TYPES_JSON = orjson.dumps(SPACE_TYPES)
+STANDARD_AMENITIES_JSON = orjson.dumps(STANDARD_AMENITIES)
+SPACE_TYPES_ETAG = f'"{hashlib.blake2b(SPACE_TYPES_JSON, digest_size=8).hexdigest()}"'
+STANDARD_AMENITIES_ETAG = f'"{hashlib.blake2b(STANDARD_AMENITIES_JSON, digest_size=8).hexdigest()}"'
+CATALOGUE_CACHE_CONTROL = "public, max-age=86400"
+
 # Models
 class UserCreate(BaseModel):
     email: str
@@ -226,106 +266,68 @@ class PlatformSyncRecord(BaseModel):
     status: str
     error_message: Optional[str]
     synced_at: str
-class Tour360Processor:
-    """Process 360-degree equirectangular images"""
-    MIN_WIDTH = 2048
-    WEB_WIDTH = 4096
-    THUMBNAIL_SIZE = (400, 200)
 
-    @staticmethod
-    def validate_360_image(image_path: str) -> tuple[bool, str]:
-        try:
-            with Image.open(image_path) as img:
-                width, height = img.size
-                if width < Tour360Processor.MIN_WIDTH:
-                    return False, f"Image too small. Minimum width: {Tour360Processor.MIN_WIDTH}px"
-                aspect_ratio = width / height
-                if not (1.8 <= aspect_ratio <= 2.2):
-                    return False, f"Not a 360° equirectangular image. Expected 2:1 ratio, got {aspect_ratio:.2f}:1"
-                return True, "Valid 360° image"
-        except Exception as e:
-            return False, f"Invalid image file: {str(e)}"
 
-    @staticmethod
-    async def process_360_image(image_path: str, tour_dir: Path, scene_name: str) -> dict:
-        try:
-            processed_path = tour_dir / f"{scene_name}_360.jpg"
-            thumbnail_path = tour_dir / f"{scene_name}_thumb.jpg"
-            
-            with Image.open(image_path) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                if img.width > Tour360Processor.WEB_WIDTH:
-                    new_height = int(img.height * Tour360Processor.WEB_WIDTH / img.width)
-                    img = img.resize((Tour360Processor.WEB_WIDTH, new_height), Image.Resampling.LANCZOS)
-                
-                img.save(processed_path, 'JPEG', quality=85, optimize=True)
-                
-                thumb = img.copy()
-                thumb.thumbnail(Tour360Processor.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                thumb.save(thumbnail_path, 'JPEG', quality=75)
-            
-            return {
-                'processed_path': processed_path.name,
-                'thumbnail_path': thumbnail_path.name,
-                'status': 'success'
-            }
-        except Exception as e:
-            raise Exception(f"Image processing failed: {str(e)}")
+class VideoTourParams(BaseModel):
+    """Query parameters for video tour generation"""
+    voice_provider: Literal["edge-tts", "elevenlabs"] = "edge-tts"
+    voice_id: str = "professional_female"
+    music_genre: Literal["upbeat", "ambient", "cinematic"] = "upbeat"
+    export_social: bool = True
+    agent_name: Optional[str] = None
+    agent_phone: Optional[str] = None
+    agent_email: Optional[str] = None
+    logo_path: Optional[str] = None
 
-    @staticmethod
-    def generate_tour_html(tour_id: str, property_title: str, scenes: List[dict]) -> str:
-        """Generate professional 360° tour viewer"""
-        scenes_json = json.dumps(scenes)
-        return f"""<!DOCTYPE html>
+# Pannellum viewer page for generated tours
+_TOUR_TPL = string.Template("""<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{property_title} - Virtual Tour</title>
+    <title>$property_title - Virtual Tour</title>
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/pannellum@2.5.6/build/pannellum.css"/>
     <script src="https://cdn.jsdelivr.net/npm/pannellum@2.5.6/build/pannellum.js"></script>
     <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif; overflow: hidden; }}
-        #panorama {{ width: 100vw; height: 100vh; }}
-        .tour-header {{
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif; overflow: hidden; }
+        #panorama { width: 100vw; height: 100vh; }
+        .tour-header {
             position: absolute; top: 20px; left: 20px; right: 20px; z-index: 1000;
             background: rgba(0,0,0,0.7); padding: 15px 25px; border-radius: 12px;
             backdrop-filter: blur(10px); display: flex; justify-content: space-between; align-items: center;
-        }}
-        .tour-title {{ color: white; font-size: 24px; font-weight: 600; }}
-        .tour-subtitle {{ color: rgba(255,255,255,0.8); font-size: 14px; margin-top: 4px; }}
-        .scene-nav {{
+        }
+        .tour-title { color: white; font-size: 24px; font-weight: 600; }
+        .tour-subtitle { color: rgba(255,255,255,0.8); font-size: 14px; margin-top: 4px; }
+        .scene-nav {
             position: absolute; bottom: 20px; left: 50%; transform: translateX(-50%); z-index: 1000;
             background: rgba(0,0,0,0.7); padding: 15px; border-radius: 12px;
             backdrop-filter: blur(10px); display: flex; gap: 10px; flex-wrap: wrap;
             max-width: 90vw; justify-content: center;
-        }}
-        .scene-btn {{
+        }
+        .scene-btn {
             background: rgba(255,255,255,0.1); color: white; border: 2px solid rgba(255,255,255,0.3);
             padding: 10px 20px; border-radius: 8px; cursor: pointer; transition: all 0.3s;
             font-size: 14px; font-weight: 500;
-        }}
-        .scene-btn:hover {{ background: rgba(255,255,255,0.2); border-color: rgba(255,255,255,0.5); }}
-        .scene-btn.active {{ background: #3b82f6; border-color: #3b82f6; }}
-        .scene-category {{
+        }
+        .scene-btn:hover { background: rgba(255,255,255,0.2); border-color: rgba(255,255,255,0.5); }
+        .scene-btn.active { background: #3b82f6; border-color: #3b82f6; }
+        .scene-category {
             width: 100%; text-align: center; color: rgba(255,255,255,0.6);
             font-size: 12px; text-transform: uppercase; letter-spacing: 1px;
             margin-top: 10px;
-        }}
-        .branding {{
+        }
+        .branding {
             position: absolute; top: 20px; right: 20px; z-index: 1000;
             background: rgba(0,0,0,0.7); padding: 10px 20px; border-radius: 8px;
             color: white; font-size: 12px; backdrop-filter: blur(10px);
-        }}
+        }
     </style>
 </head>
 <body>
     <div class="tour-header">
         <div>
-            <div class="tour-title">{property_title}</div>
+            <div class="tour-title">$property_title</div>
             <div class="tour-subtitle" id="currentRoom">Loading...</div>
         </div>
     </div>
@@ -334,102 +336,583 @@ class Tour360Processor:
     <div class="scene-nav" id="sceneNav"></div>
     
     <script>
-        const scenes = {scenes_json};
+        const scenes = $scenes_json;
         let viewer;
         let currentSceneIndex = 0;
 
-        function initTour() {{
-            if (scenes.length === 0) {{
+        function initTour() {
+            if (scenes.length === 0) {
                 document.getElementById('panorama').innerHTML = 
                     '<div style="display: flex; align-items: center; justify-content: center; height: 100vh; color: white; font-size: 24px;">No scenes available</div>';
                 return;
-            }}
+            }
 
-            viewer = pannellum.viewer('panorama', {{
-                default: {{
+            viewer = pannellum.viewer('panorama', {
+                default: {
                     firstScene: scenes[0].id,
                     sceneFadeDuration: 1000,
                     autoLoad: true
-                }},
-                scenes: scenes.reduce((acc, scene) => {{
-                    acc[scene.id] = {{
+                },
+                scenes: scenes.reduce((acc, scene) => {
+                    acc[scene.id] = {
                         type: "equirectangular",
                         panorama: scene.imageUrl,
                         pitch: scene.pitch || 0,
                         yaw: scene.yaw || 0,
                         hfov: scene.fov || 100,
                         autoRotate: -2
-                    }};
+                    };
                     return acc;
-                }}, {{}})
-            }});
+                }, {})
+            });
 
             createSceneNavigation();
             updateCurrentRoom(0);
             
-            fetch('/api/tours/{tour_id}/view', {{ method: 'POST' }}).catch(e => console.log(e));
-        }}
+            fetch('/api/tours/$tour_id/view', { method: 'POST' }).catch(e => console.log(e));
+        }
 
-        function createSceneNavigation() {{
+        function createSceneNavigation() {
             const nav = document.getElementById('sceneNav');
             let lastCategory = '';
             
-            scenes.forEach((scene, index) => {{
-                if (scene.category && scene.category !== lastCategory) {{
+            scenes.forEach((scene, index) => {
+                if (scene.category && scene.category !== lastCategory) {
                     const categoryDiv = document.createElement('div');
                     categoryDiv.className = 'scene-category';
                     categoryDiv.textContent = scene.category;
                     nav.appendChild(categoryDiv);
                     lastCategory = scene.category;
-                }}
+                }
                 
                 const btn = document.createElement('button');
                 btn.className = 'scene-btn' + (index === 0 ? ' active' : '');
                 btn.textContent = scene.name;
                 btn.onclick = () => switchScene(index);
                 nav.appendChild(btn);
-            }});
-        }}
+            });
+        }
 
-        function switchScene(index) {{
+        function switchScene(index) {
             if (index < 0 || index >= scenes.length) return;
             
             currentSceneIndex = index;
             viewer.loadScene(scenes[index].id, scenes[index].pitch || 0, scenes[index].yaw || 0, scenes[index].fov || 100);
             updateCurrentRoom(index);
             
-            document.querySelectorAll('.scene-btn').forEach((btn, i) => {{
+            document.querySelectorAll('.scene-btn').forEach((btn, i) => {
                 btn.classList.toggle('active', i === index);
-            }});
-        }}
+            });
+        }
 
-        function updateCurrentRoom(index) {{
+        function updateCurrentRoom(index) {
             const room = scenes[index];
             document.getElementById('currentRoom').textContent = 
-                room.category ? `${{room.category}} - ${{room.name}}` : room.name;
-        }}
+                room.category ? `$${room.category} - $${room.name}` : room.name;
+        }
 
         window.addEventListener('load', initTour);
     </script>
 </body>
-</html>"""
+</html>""")
+
+class Tour360Processor:
+    """Process 360-degree equirectangular images"""
+    MIN_WIDTH = 2048
+    WEB_WIDTH = 4096
+    THUMBNAIL_SIZE = (400, 200)
+
+    # Start-of-frame markers that carry the frame dimensions (excludes DHT/JPG/DAC)
+    JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                                  0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+
+    @staticmethod
+    def read_jpeg_size(image_path: str) -> Optional[tuple[int, int]]:
+        """Read (width, height) from the JPEG SOF header without decoding pixels"""
+        with open(image_path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                marker = f.read(2)
+                if len(marker) != 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] == 0xFF:  # fill byte before the real marker
+                    f.seek(-1, 1)
+                    continue
+                if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:  # no length field
+                    continue
+                header = f.read(2)
+                if len(header) != 2:
+                    return None
+                length, = struct.unpack('>H', header)
+                if marker[1] in Tour360Processor.JPEG_SOF_MARKERS:
+                    frame = f.read(5)
+                    if len(frame) != 5:
+                        return None
+                    height, width = struct.unpack('>HH', frame[1:5])
+                    return width, height
+                f.seek(length - 2, 1)
+
+    @staticmethod
+    def validate_360_image(image_path: str) -> tuple[bool, str]:
+        try:
+            size = Tour360Processor.read_jpeg_size(image_path)
+            if not size or not all(size):
+                with Image.open(image_path) as img:
+                    size = img.size
+            width, height = size
+            if width < Tour360Processor.MIN_WIDTH:
+                return False, f"Image too small. Minimum width: {Tour360Processor.MIN_WIDTH}px"
+            aspect_ratio = width / height
+            if not (1.8 <= aspect_ratio <= 2.2):
+                return False, f"Not a 360° equirectangular image. Expected 2:1 ratio, got {aspect_ratio:.2f}:1"
+            return True, "Valid 360° image"
+        except Exception as e:
+            return False, f"Invalid image file: {str(e)}"
+
+    @staticmethod
+    async def process_360_image(image_path: str, tour_dir: Path, scene_name: str) -> dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            IMAGE_EXECUTOR, Tour360Processor._process_360_sync, image_path, tour_dir, scene_name
+        )
+
+    @staticmethod
+    def _process_360_sync(image_path: str, tour_dir: Path, scene_name: str) -> dict:
+        try:
+            processed_path = tour_dir / f"{scene_name}_360.jpg"
+            thumbnail_path = tour_dir / f"{scene_name}_thumb.jpg"
+            
+            with Image.open(image_path) as img:
+                # Let libjpeg decode large panoramas at a reduced scale (no-op for other formats)
+                img.draft('RGB', (Tour360Processor.WEB_WIDTH, Tour360Processor.WEB_WIDTH // 2))
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                
+                # Bound only the width; thumbnail() keeps the ratio and never upscales
+                img.thumbnail(
+                    (Tour360Processor.WEB_WIDTH, img.height),
+                    Image.Resampling.LANCZOS,
+                    reducing_gap=3.0
+                )
+                
+                if mozjpeg_lossless_optimization:
+                    buffer = io.BytesIO()
+                    img.save(buffer, 'JPEG', quality=85)
+                    processed_path.write_bytes(
+                        mozjpeg_lossless_optimization.optimize(buffer.getvalue())
+                    )
+                else:
+                    img.save(processed_path, 'JPEG', quality=85, optimize=True)
+                
+                # The full-size image is no longer needed, so shrink it in place
+                img.thumbnail(Tour360Processor.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+                img.save(thumbnail_path, 'JPEG', quality=75)
+            
+            if JPEGOPTIM:
+                Tour360Processor.optimize_jpeg(processed_path, 85)
+                Tour360Processor.optimize_jpeg(thumbnail_path, 75)
+            
+            return {
+                'processed_path': processed_path.name,
+                'thumbnail_path': thumbnail_path.name,
+                'status': 'success'
+            }
+        except Exception as e:
+            raise Exception(f"Image processing failed: {str(e)}")
+
+    @staticmethod
+    def optimize_jpeg(path: Path, max_quality: int):
+        """Run jpegoptim in place; the unoptimized file is kept if it fails"""
+        result = subprocess.run(
+            [JPEGOPTIM, "--quiet", "--strip-all", "--all-progressive", f"--max={max_quality}", str(path)],
+            capture_output=True
+        )
+        if result.returncode != 0:
+            logger.error(f"jpegoptim failed for {path.name}: {result.stderr.decode(errors='replace')}")
+
+    @staticmethod
+    def generate_tour_html(tour_id: str, property_title: str, scenes: List[dict]) -> str:
+        """Generate professional 360° tour viewer"""
+        return _TOUR_TPL.substitute(
+            property_title=property_title,
+            scenes_json=json_text(scenes),
+            tour_id=tour_id
+        )
+
+def save_upload(upload: UploadFile, dest: Path):
+    """Copy an upload's spooled temp file to disk in chunks, rejecting oversized files"""
+    if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(413, "File too large")
+    upload.file.seek(0)
+    written = 0
+    with open(dest, "wb") as out:
+        while chunk := upload.file.read(UPLOAD_CHUNK_SIZE):
+            written += len(chunk)
+            if written > MAX_UPLOAD_BYTES:
+                break
+            out.write(chunk)
+    if written > MAX_UPLOAD_BYTES:
+        dest.unlink()
+        raise HTTPException(413, "File too large")
+
+def json_text(obj) -> str:
+    """Serialize to JSON for storage in a TEXT column"""
+    return orjson.dumps(obj).decode()
+
+# Column lists for the read paths; keys of dict(row) follow these names
+PROPERTY_COLS = ("id, user_id, title, description, address, price, property_type, "
+                 "bedrooms, bathrooms, square_feet, features, has_tour")
+ROOM_COLS = ("id, property_id, space_name, space_type, space_category, description, "
+             "square_feet, image_360_url, thumbnail_url, processing_status, sort_order, created_at")
+TOUR_COLS = "id, property_id, tour_name, tour_url, status, total_scenes, created_at, completed_at"
+SCENE_COLS = "id, space_name, space_type, space_category, description, image_360_url"
+
+# Property cache
+PROPERTY_CACHE_TTL = 60  # seconds
+PROPERTY_CACHE_SIZE = 1024
+_property_cache: dict = {}
+
+async def load_property(db: aiosqlite.Connection, property_id: str) -> Optional[dict]:
+    """Get a property as a dict, served from a short-lived in-process cache"""
+    cached = _property_cache.get(property_id)
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1])
+    
+    async with db.execute(
+        f"SELECT {PROPERTY_COLS} FROM properties WHERE id = ?", (property_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    if not row:
+        return None
+    
+    property_data = dict(row)
+    property_data['features'] = orjson.loads(row['features'] or '[]')
+    property_data['has_tour'] = bool(row['has_tour'])
+    
+    if len(_property_cache) >= PROPERTY_CACHE_SIZE:
+        _property_cache.pop(next(iter(_property_cache)))
+    _property_cache[property_id] = (time.monotonic() + PROPERTY_CACHE_TTL, property_data)
+    return dict(property_data)
+
+def invalidate_property(property_id: str):
+    """Drop a cached property after it has been written"""
+    _property_cache.pop(property_id, None)
+
+# Database schema, applied in one write transaction at startup; init_db commits it
+# together with the user_version stamp.
+_SCHEMA_SQL = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    password TEXT NOT NULL,
+    plan TEXT DEFAULT 'free',
+    listings_created INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    subscription_id TEXT,
+    subscription_plan TEXT,
+    subscription_status TEXT
+);
+
+CREATE TABLE IF NOT EXISTS properties (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    address TEXT NOT NULL,
+    price TEXT NOT NULL,
+    property_type TEXT NOT NULL,
+    bedrooms INTEGER,
+    bathrooms REAL,
+    square_feet INTEGER,
+    features TEXT,
+    has_tour BOOLEAN DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE TABLE IF NOT EXISTS rooms (
+    id TEXT PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    space_name TEXT NOT NULL,
+    space_type TEXT NOT NULL,
+    space_category TEXT NOT NULL,
+    description TEXT,
+    square_feet INTEGER,
+    image_360_url TEXT,
+    thumbnail_url TEXT,
+    processing_status TEXT DEFAULT 'pending',
+    sort_order INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS tours (
+    id TEXT PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    tour_name TEXT NOT NULL,
+    tour_url TEXT,
+    status TEXT DEFAULT 'draft',
+    total_scenes INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS video_tours (
+    id TEXT PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    video_url TEXT,
+    duration_seconds INTEGER,
+    script TEXT,
+    social_exports TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id)
+);
+
+CREATE TABLE IF NOT EXISTS viral_content (
+    id TEXT PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    viral_score INTEGER NOT NULL,
+    hashtags TEXT,
+    ai_generated INTEGER DEFAULT 1,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id)
+) STRICT;
+
+CREATE TABLE IF NOT EXISTS analytics (
+    id INTEGER PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    views INTEGER DEFAULT 0,
+    shares INTEGER DEFAULT 0,
+    engagement_rate REAL DEFAULT 0.0,
+    viral_score INTEGER DEFAULT 0,
+    tour_views INTEGER DEFAULT 0,
+    trending_status TEXT DEFAULT 'normal',
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id)
+);
+
+CREATE TABLE IF NOT EXISTS narrated_tours (
+    id TEXT PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    tour_url TEXT,
+    voice_id TEXT,
+    narration_files TEXT,
+    status TEXT DEFAULT 'completed',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id)
+);
+
+CREATE TABLE IF NOT EXISTS complete_tours (
+    id TEXT PRIMARY KEY,
+    property_id TEXT NOT NULL,
+    tour_url TEXT,
+    voice_enabled BOOLEAN,
+    music_enabled BOOLEAN,
+    total_scenes INTEGER,
+    property_type TEXT,
+    status TEXT DEFAULT 'completed',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (property_id) REFERENCES properties (id)
+);
+
+-- Covers the dashboard aggregate: filter on user_id, join on id, sum has_tour
+CREATE INDEX IF NOT EXISTS idx_properties_user ON properties(user_id, id, has_tour);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_analytics_property ON analytics(property_id);
+CREATE INDEX IF NOT EXISTS idx_rooms_prop_sort ON rooms(property_id, sort_order);
+CREATE INDEX IF NOT EXISTS idx_rooms_prop_360 ON rooms(property_id, sort_order) WHERE image_360_url IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_tours_prop_created ON tours(property_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_video_tours_property ON video_tours(property_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_viral_prop_time ON viral_content(property_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_narrated_tours_property ON narrated_tours(property_id);
+CREATE INDEX IF NOT EXISTS idx_complete_tours_property ON complete_tours(property_id);
+"""
+
+# Columns added to users after it first shipped; CREATE TABLE IF NOT EXISTS
+# leaves older databases without them, so init_db adds whichever are missing
+USER_MIGRATION_COLUMNS = {
+    "subscription_id": "TEXT",
+    "subscription_plan": "TEXT",
+    "subscription_status": "TEXT",
+}
+
+# Derived from the schema text and the column migrations so any edit to either
+# re-applies them; user_version is a signed 32-bit int and 0 means a fresh database
+SCHEMA_VERSION = int.from_bytes(
+    hashlib.blake2b(
+        (_SCHEMA_SQL + repr(USER_MIGRATION_COLUMNS)).encode(), digest_size=4
+    ).digest(), "big"
+) & 0x7FFFFFFF or 1
+
+# Database
+DB_READERS = os.cpu_count() or 4
+DB_CACHED_STATEMENTS = 256  # per-connection prepared statement cache, sqlite3 default is 128
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",  # wait out a checkpoint instead of raising SQLITE_BUSY
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",  # 64 MB page cache
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA cache_spill=OFF",  # keep dirty pages in memory until commit
+)
+
+async def configure_connection(db: aiosqlite.Connection):
+    """Apply the connection PRAGMAs once after opening"""
+    for pragma in SQLITE_PRAGMAS:
+        await db.execute(pragma)
+    await db.commit()
+
+async def open_connection(read_only: bool = False) -> aiosqlite.Connection:
+    """Open a configured connection; read-only ones cannot take the write lock"""
+    if read_only:
+        db = await aiosqlite.connect(
+            f"file:{DATABASE_PATH}?mode=ro", uri=True, cached_statements=DB_CACHED_STATEMENTS
+        )
+    else:
+        # Transactions on the writer are opened explicitly by DBPool.writer()
+        db = await aiosqlite.connect(
+            DATABASE_PATH, isolation_level=None, cached_statements=DB_CACHED_STATEMENTS
+        )
+    db.row_factory = aiosqlite.Row
+    await configure_connection(db)
+    return db
+
+class DBPool:
+    """One writer connection plus a queue of read-only connections"""
+
+    def __init__(self, readers: int = DB_READERS):
+        self.size = readers
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+
+    async def open(self):
+        self._writer = await open_connection()
+        await init_db(self._writer)
+        # Read-only connections need the database file to exist, so open them after init
+        for _ in range(self.size):
+            self._readers.put_nowait(await open_connection(read_only=True))
+
+    async def close(self):
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+        if self._writer:
+            await self._writer.close()
+
+    @asynccontextmanager
+    async def reader(self):
+        """Borrow a read-only connection; WAL lets these run beside the writer"""
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Run a block in a BEGIN IMMEDIATE transaction on the single writer"""
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+                # A failed COMMIT is rolled back too, so the writer never stays mid-transaction
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+async def get_read_db():
+    """Read-only connection borrowed from the pool for the request"""
+    async with app.state.pool.reader() as db:
+        yield db
+
+# Tour view buffering
+VIEW_FLUSH_INTERVAL = 5  # seconds
+VIEW_FLUSH_THRESHOLD = 1000  # buffered views that trigger an early flush
+_pending_views: Counter = Counter()
+
+def record_tour_view(tour_id: str):
+    """Buffer a view; it reaches analytics on the next flush"""
+    _pending_views[tour_id] += 1
+    if _pending_views.total() >= VIEW_FLUSH_THRESHOLD:
+        app.state.flush_requested.set()
+
+async def flush_tour_views(pool: DBPool):
+    """Write buffered tour views to analytics in one batch"""
+    if not _pending_views:
+        return
+    pending = _pending_views.copy()
+    _pending_views.clear()
+    batch = [(count, count, tour_id) for tour_id, count in pending.items()]
+    try:
+        async with pool.writer() as db:
+            await db.executemany("""
+                INSERT INTO analytics (property_id, tour_views, views)
+                SELECT property_id, ?, ? FROM tours WHERE id = ?
+                ON CONFLICT(property_id) DO UPDATE SET
+                   tour_views = tour_views + excluded.tour_views,
+                   views = views + excluded.views
+            """, batch)
+    except BaseException:
+        # Put the views back so the next flush retries them
+        _pending_views.update(pending)
+        logger.error(f"Tour view flush failed; {pending.total()} views kept for retry")
+        raise
+
+async def tour_view_flush_loop(pool: DBPool, flush_requested: asyncio.Event):
+    """Flush buffered tour views every interval, or sooner under burst load"""
+    while True:
+        try:
+            await asyncio.wait_for(flush_requested.wait(), VIEW_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        flush_requested.clear()
+        try:
+            await flush_tour_views(pool)
+        except Exception as e:
+            logger.error(f"Tour view flush error: {e}")
 
 # Lifecycle
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
+    app.state.pool = DBPool()
+    await app.state.pool.open()
+    # Created here so it belongs to the loop the flush task runs on
+    app.state.flush_requested = asyncio.Event()
+    view_flusher = asyncio.create_task(
+        tour_view_flush_loop(app.state.pool, app.state.flush_requested)
+    )
     logger.info("=" * 60)
     logger.info("ListingSpark AI Professional Backend Started!")
     logger.info(f"Database: {DATABASE_PATH}")
     logger.info(f"Tours Directory: {TOURS_DIR}")
+    logger.info(f"Pillow {PIL.__version__} (libjpeg-turbo: {pil_features.check_feature('libjpeg_turbo')})")
     logger.info("=" * 60)
     yield
+    view_flusher.cancel()
+    try:
+        await view_flusher
+    except asyncio.CancelledError:
+        pass
+    await flush_tour_views(app.state.pool)
+    await app.state.pool.close()
+    await OPENAI_HTTP.aclose()
+    IMAGE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
     logger.info("Shutting down ListingSpark AI Backend")
 
 # Initialize FastAPI
 app = FastAPI(
     title="ListingSpark AI Professional",
     description="Professional real estate virtual tour platform",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -437,7 +920,7 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=[
         "https://wonderful-narwhal-f556de.netlify.app",  # your Netlify frontend
-        "http://192.168.1.85:3000",0
+        "http://192.168.1.85:3000",
         "http://localhost:3000",  # for local frontend testing
         "http://localhost:8000"   # optional, if testing backend directly
     ],
@@ -470,122 +953,80 @@ app.include_router(subscription.router, prefix="/api/subscription", tags=["subsc
 async def create_user(user_data: UserCreate):
     """Create a new user"""
     user_id = str(uuid.uuid4())
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with app.state.pool.writer() as db:
             await db.execute(
                 "INSERT INTO users (id, email, name, password, plan) VALUES (?, ?, ?, ?, ?)",
                 (user_id, user_data.email, user_data.name, user_data.password, "free")
             )
-            await db.commit()
-            return {
-                "id": user_id,
-                "email": user_data.email,
-                "name": user_data.name,
-                "plan": "free",
-                "listings_created": 0
-            }
-        except aiosqlite.IntegrityError:
-            raise HTTPException(400, "Email already exists")
+    except aiosqlite.IntegrityError:
+        raise HTTPException(400, "Email already exists")
+    return {
+        "id": user_id,
+        "email": user_data.email,
+        "name": user_data.name,
+        "plan": "free",
+        "listings_created": 0
+    }
 
 @app.post("/api/login")
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, db: aiosqlite.Connection = Depends(get_read_db)):
     """Login or create user"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT * FROM users WHERE email = ? AND password = ?", (user_data.email, user_data.password)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return {
-                    "id": row[0], "email": row[1], "name": row[2],
-                    "plan": row[4], "listings_created": row[5]
-                }
-            else:
-                raise HTTPException(401, "Invalid email or password")
-async def init_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                email TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                password TEXT NOT NULL,
-                plan TEXT DEFAULT 'free',
-                listings_created INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS properties (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                title TEXT NOT NULL,
-                description TEXT NOT NULL,
-                address TEXT NOT NULL,
-                price TEXT NOT NULL,
-                property_type TEXT NOT NULL,
-                bedrooms INTEGER,
-                bathrooms REAL,
-                square_feet INTEGER,
-                features TEXT,
-                has_tour BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS rooms (
-                id TEXT PRIMARY KEY,
-                property_id TEXT NOT NULL,
-                space_name TEXT NOT NULL,
-                space_type TEXT NOT NULL,
-                space_category TEXT NOT NULL,
-                description TEXT,
-                square_feet INTEGER,
-                image_360_url TEXT,
-                thumbnail_url TEXT,
-                processing_status TEXT DEFAULT 'pending',
-                sort_order INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (property_id) REFERENCES properties (id) ON DELETE CASCADE
-            )
-        """)
-        
-        await db.commit()
-        logger.info("Database initialized successfully")
+    async with db.execute(
+        "SELECT id, email, name, plan, listings_created FROM users WHERE email = ? AND password = ?",
+        (user_data.email, user_data.password)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if row:
+            return dict(row)
+        else:
+            raise HTTPException(401, "Invalid email or password")
+async def init_db(db: aiosqlite.Connection):
+    """Apply the schema on the shared writer unless user_version is already current"""
+    async with db.execute("PRAGMA user_version") as cursor:
+        (version,) = await cursor.fetchone()
+    if version == SCHEMA_VERSION:
+        logger.info("Database schema up to date")
+        return
+    
+    await db.executescript(_SCHEMA_SQL)  # opens BEGIN IMMEDIATE
+    existing = {row[0] for row in await db.execute_fetchall("SELECT name FROM pragma_table_info('users')")}
+    for column, decl in USER_MIGRATION_COLUMNS.items():
+        if column not in existing:
+            await db.execute(f"ALTER TABLE users ADD COLUMN {column} {decl}")
+    await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    await db.commit()
+    logger.info("Database initialized successfully")
 
     
 
 @api_router.get("/properties/{property_id}/rooms")
-async def get_property_rooms(property_id: str):
+async def get_property_rooms(
+    property_id: str,
+    request: Request,
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
     """Get all rooms for a property"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT * FROM rooms WHERE property_id = ? ORDER BY sort_order",
-            (property_id,)
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [{
-                'id': row[0], 'property_id': row[1], 'space_name': row[2],
-                'space_type': row[3], 'space_category': row[4],
-                'description': row[5], 'square_feet': row[6],
-                'image_360_url': row[7], 'thumbnail_url': row[8],
-                'processing_status': row[9], 'sort_order': row[10],
-                'created_at': row[11]
-            } for row in rows]
+    # The ETag is derived from the current rows, so every worker agrees on it after a write
+    rows = await db.execute_fetchall(
+        f"SELECT {ROOM_COLS} FROM rooms WHERE property_id = ? ORDER BY sort_order",
+        (property_id,)
+    )
+    payload = orjson.dumps([dict(row) for row in rows])
+    etag = f'"{hashlib.blake2b(payload, digest_size=8).hexdigest()}"'
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(payload, media_type="application/json", headers={"ETag": etag})
 
 @api_router.post("/rooms/{room_id}/upload-360")
 async def upload_room_360(room_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """Upload 360° image for a room"""
     upload_path = UPLOADS_DIR / f"{room_id}_{file.filename}"
     
-    with open(upload_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    await asyncio.to_thread(save_upload, file, upload_path)
     
-    is_valid, message = Tour360Processor.validate_360_image(str(upload_path))
+    is_valid, message = await asyncio.to_thread(Tour360Processor.validate_360_image, str(upload_path))
     if not is_valid:
         upload_path.unlink()
         raise HTTPException(400, message)
@@ -596,114 +1037,124 @@ async def upload_room_360(room_id: str, background_tasks: BackgroundTasks, file:
 
 async def process_room_360_background(room_id: str, image_path: str):
     """Background processing for room 360 image"""
+    pool = app.state.pool
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with pool.reader() as db:
             async with db.execute("SELECT property_id, space_name FROM rooms WHERE id = ?", (room_id,)) as cursor:
                 room = await cursor.fetchone()
-                if not room:
-                    return
-                
-                property_id, space_name = room
-            
-            room_dir = TOURS_DIR / property_id / room_id
-            room_dir.mkdir(parents=True, exist_ok=True)
-            
-            result = await Tour360Processor.process_360_image(image_path, room_dir, space_name.replace(" ", "_"))
-            
-            image_url = f"/tours/{property_id}/{room_id}/{result['processed_path']}"
-            thumbnail_url = f"/tours/{property_id}/{room_id}/{result['thumbnail_path']}"
-            
-            async with aiosqlite.connect(DATABASE_PATH) as db:
-                await db.execute("""
-                    UPDATE rooms 
-                    SET image_360_url = ?, thumbnail_url = ?, processing_status = 'completed'
-                    WHERE id = ?
-                """, (image_url, thumbnail_url, room_id))
-                await db.commit()
-            
-            logger.info(f"Room {room_id} 360 image processed successfully")
-    
+            if not room:
+                return
+
+            property_id, space_name = room
+
+        room_dir = TOURS_DIR / property_id / room_id
+        room_dir.mkdir(parents=True, exist_ok=True)
+
+        result = await Tour360Processor.process_360_image(image_path, room_dir, space_name.replace(" ", "_"))
+
+        image_url = f"/tours/{property_id}/{room_id}/{result['processed_path']}"
+        thumbnail_url = f"/tours/{property_id}/{room_id}/{result['thumbnail_path']}"
+
+        async with pool.writer() as db:
+            await db.execute("""
+                UPDATE rooms
+                SET image_360_url = ?, thumbnail_url = ?, processing_status = 'completed'
+                WHERE id = ?
+            """, (image_url, thumbnail_url, room_id))
+
+        logger.info(f"Room {room_id} 360 image processed successfully")
+
     except Exception as e:
         logger.error(f"Room 360 processing error: {e}")
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with pool.writer() as db:
             await db.execute(
                 "UPDATE rooms SET processing_status = 'failed' WHERE id = ?",
                 (room_id,)
             )
-            await db.commit()
 
 @api_router.delete("/rooms/{room_id}")
 async def delete_room(room_id: str):
     """Delete a room"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with app.state.pool.writer() as db:
         await db.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
-        await db.commit()
     return {"message": "Room deleted successfully"}
 
 @api_router.put("/rooms/{room_id}/reorder")
 async def reorder_room(room_id: str, new_order: int):
     """Update room sort order"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with app.state.pool.writer() as db:
         await db.execute(
             "UPDATE rooms SET sort_order = ? WHERE id = ?",
             (new_order, room_id)
         )
-        await db.commit()
     return {"message": "Room order updated"}
 
 # Tour Generation
 @api_router.post("/properties/{property_id}/generate-tour")
-async def generate_property_tour(property_id: str, background_tasks: BackgroundTasks):
+async def generate_property_tour(
+    property_id: str,
+    background_tasks: BackgroundTasks,
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
     """Generate complete virtual tour from all rooms"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Check property exists
-        async with db.execute("SELECT title FROM properties WHERE id = ?", (property_id,)) as cursor:
-            property_row = await cursor.fetchone()
-            if not property_row:
-                raise HTTPException(404, "Property not found")
-            property_title = property_row[0]
-        
-        # Get all completed rooms
-        async with db.execute(
-            """SELECT id, space_name, space_category, image_360_url, sort_order 
-               FROM rooms 
-               WHERE property_id = ? AND processing_status = 'completed' AND image_360_url IS NOT NULL
-               ORDER BY sort_order""",
-            (property_id,)
-        ) as cursor:
-            rooms = await cursor.fetchall()
-            
-            if not rooms:
-                raise HTTPException(400, "No completed rooms with 360° images found")
-        
-        tour_id = str(uuid.uuid4())
-        
-        # Create tour record
-        await db.execute("""
+    # Check property exists
+    async with db.execute("SELECT title FROM properties WHERE id = ?", (property_id,)) as cursor:
+        property_row = await cursor.fetchone()
+        if not property_row:
+            raise HTTPException(404, "Property not found")
+        property_title = property_row[0]
+
+    # Get all completed rooms
+    rooms = await db.execute_fetchall(
+        """SELECT id, space_name, space_category, image_360_url, sort_order
+           FROM rooms
+           WHERE property_id = ? AND processing_status = 'completed' AND image_360_url IS NOT NULL
+           ORDER BY sort_order""",
+        (property_id,)
+    )
+    if not rooms:
+        raise HTTPException(400, "No completed rooms with 360° images found")
+
+    tour_id = str(uuid.uuid4())
+
+    # Create tour record
+    async with app.state.pool.writer() as writer:
+        await writer.execute("""
             INSERT INTO tours (id, property_id, tour_name, status, total_scenes)
             VALUES (?, ?, ?, 'generating', ?)
         """, (tour_id, property_id, f"{property_title} - Virtual Tour", len(rooms)))
-        await db.commit()
     
     background_tasks.add_task(generate_tour_background, tour_id, property_id, property_title, rooms)
     
     return {"tour_id": tour_id, "status": "generating", "message": "Generating virtual tour..."}
 
+async def mark_tour_completed(tour_id: str, tour_url: str, property_id: str):
+    """Record a finished tour and flag its property"""
+    async with app.state.pool.writer() as db:
+        await db.execute("""
+            UPDATE tours
+            SET tour_url = ?, status = 'completed', completed_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (tour_url, tour_id))
+
+        await db.execute(
+            "UPDATE properties SET has_tour = 1 WHERE id = ?",
+            (property_id,)
+        )
+    invalidate_property(property_id)
+
 async def generate_tour_background(tour_id: str, property_id: str, property_title: str, rooms: list):
     """Background task to generate complete tour"""
     try:
-        scenes = []
-        for idx, room in enumerate(rooms):
-            room_id, space_name, space_category, image_url, sort_order = room
-            scenes.append({
-                'id': room_id,
-                'name': space_name,
-                'category': space_category,
-                'imageUrl': image_url,
-                'pitch': 0,
-                'yaw': 0,
-                'fov': 100
-            })
+        scenes = [{
+            'id': room_id,
+            'name': space_name,
+            'category': space_category,
+            'imageUrl': image_url,
+            'pitch': 0,
+            'yaw': 0,
+            'fov': 100
+        } for room_id, space_name, space_category, image_url, _ in rooms]
         
         # Generate HTML tour
         tour_html = Tour360Processor.generate_tour_html(tour_id, property_title, scenes)
@@ -711,78 +1162,43 @@ async def generate_tour_background(tour_id: str, property_id: str, property_titl
         tour_dir.mkdir(parents=True, exist_ok=True)
         
         html_path = tour_dir / "tour.html"
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(tour_html)
-        
         tour_url = f"/tours/{property_id}/tour.html"
         
-        # Update database
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute("""
-                UPDATE tours 
-                SET tour_url = ?, status = 'completed', completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (tour_url, tour_id))
-            
-            await db.execute(
-                "UPDATE properties SET has_tour = 1 WHERE id = ?",
-                (property_id,)
-            )
-            await db.commit()
-        
+        # The page must exist before the tour is marked completed
+        await asyncio.to_thread(html_path.write_text, tour_html, encoding='utf-8')
+        await mark_tour_completed(tour_id, tour_url, property_id)
+
         logger.info(f"Tour {tour_id} generated successfully with {len(scenes)} scenes")
-    
+
     except Exception as e:
         logger.error(f"Tour generation error: {e}")
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with app.state.pool.writer() as db:
             await db.execute(
                 "UPDATE tours SET status = 'failed' WHERE id = ?",
                 (tour_id,)
             )
-            await db.commit()
 
 @api_router.get("/properties/{property_id}/tour")
-async def get_property_tour(property_id: str):
+async def get_property_tour(property_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Get the tour for a property"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT * FROM tours WHERE property_id = ? ORDER BY created_at DESC LIMIT 1",
-            (property_id,)
-        ) as cursor:
-            tour = await cursor.fetchone()
-            if not tour:
-                raise HTTPException(404, "No tour found for this property")
-            
-            return {
-                'id': tour[0],
-                'property_id': tour[1],
-                'tour_name': tour[2],
-                'tour_url': tour[3],
-                'status': tour[4],
-                'total_scenes': tour[5],
-                'created_at': tour[6],
-                'completed_at': tour[7]
-            }
-
-@api_router.post("/tours/{tour_id}/view")
-async def track_tour_view(tour_id: str):
+    async with db.execute(
+        f"SELECT {TOUR_COLS} FROM tours WHERE property_id = ? ORDER BY created_at DESC LIMIT 1",
+        (property_id,)
+    ) as cursor:
+        tour = await cursor.fetchone()
+        if not tour:
+            raise HTTPException(404, "No tour found for this property")
+
+        return dict(tour)
+
+@api_router.post("/api/tours/{tour_id}/view", status_code=202)
+async def track_tour_view(tour_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Track tour view for analytics"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT property_id FROM tours WHERE id = ?", (tour_id,)) as cursor:
-            result = await cursor.fetchone()
-            if not result:
-                raise HTTPException(404, "Tour not found")
-            property_id = result[0]
-        
-        await db.execute("""
-            INSERT INTO analytics (property_id, tour_views, views)
-            VALUES (?, 1, 1)
-            ON CONFLICT(property_id) DO UPDATE SET
-               tour_views = tour_views + 1,
-               views = views + 1
-        """, (property_id,))
-        await db.commit()
-    
+    async with db.execute("SELECT 1 FROM tours WHERE id = ?", (tour_id,)) as cursor:
+        if not await cursor.fetchone():
+            raise HTTPException(404, "Tour not found")
+    # Views are coalesced and written by tour_view_flush_loop
+    record_tour_view(tour_id)
     return {"message": "View tracked"}
 
 @api_router.get("/voice-options")
@@ -798,55 +1214,29 @@ async def generate_narrated_tour(
     property_id: str,
     background_tasks: BackgroundTasks,
     voice_id: str = "professional_female",
-    include_music: bool = True
+    include_music: bool = True,
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
     """Generate complete 360° tour with professional voice narration"""
-    
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Get property data
-        async with db.execute(
-            "SELECT * FROM properties WHERE id = ?", (property_id,)
-        ) as cursor:
-            prop_row = await cursor.fetchone()
-            if not prop_row:
-                raise HTTPException(404, "Property not found")
-            
-            property_data = {
-                'id': prop_row[0],
-                'user_id': prop_row[1],
-                'title': prop_row[2],
-                'description': prop_row[3],
-                'address': prop_row[4],
-                'price': prop_row[5],
-                'property_type': prop_row[6],
-                'bedrooms': prop_row[7],
-                'bathrooms': prop_row[8],
-                'square_feet': prop_row[9]
-            }
-        
-        # Get rooms with 360 images
-        async with db.execute(
-            """SELECT * FROM rooms 
-               WHERE property_id = ? AND processing_status = 'completed' 
-               ORDER BY sort_order""",
-            (property_id,)
-        ) as cursor:
-            room_rows = await cursor.fetchall()
-            
-            if not room_rows:
-                raise HTTPException(400, "No completed rooms found for this property")
-            
-            rooms = [{
-                'id': r[0],
-                'property_id': r[1],
-                'space_name': r[2],
-                'space_type': r[3],
-                'space_category': r[4],
-                'description': r[5],
-                'square_feet': r[6],
-                'image_360_url': r[7],
-                'sort_order': r[10]
-            } for r in room_rows]
+
+    # Get property data
+    property_data = await load_property(db, property_id)
+    if not property_data:
+        raise HTTPException(404, "Property not found")
+
+    # Get rooms with 360 images
+    room_rows = await db.execute_fetchall(
+        """SELECT id, property_id, space_name, space_type, space_category, description,
+                  square_feet, image_360_url, sort_order
+           FROM rooms
+           WHERE property_id = ? AND processing_status = 'completed'
+           ORDER BY sort_order""",
+        (property_id,)
+    )
+    if not room_rows:
+        raise HTTPException(400, "No completed rooms found for this property")
+
+    rooms = [dict(r) for r in room_rows]
     
     # Start background processing
     background_tasks.add_task(
@@ -918,27 +1308,12 @@ async def process_narrated_tour_background(
         )
         
         html_path = tour_dir / "tour_narrated.html"
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(tour_html)
+        await asyncio.to_thread(html_path.write_text, tour_html, encoding='utf-8')
         
         tour_url = f"/tours/{property_id}/tour_narrated.html"
         
         # Update database
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Create narrated_tours table if not exists
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS narrated_tours (
-                    id TEXT PRIMARY KEY,
-                    property_id TEXT NOT NULL,
-                    tour_url TEXT,
-                    voice_id TEXT,
-                    narration_files TEXT,
-                    status TEXT DEFAULT 'completed',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (property_id) REFERENCES properties (id)
-                )
-            """)
-            
+        async with app.state.pool.writer() as db:
             tour_id = str(uuid.uuid4())
             await db.execute("""
                 INSERT INTO narrated_tours 
@@ -949,15 +1324,14 @@ async def process_narrated_tour_background(
                 property_id,
                 tour_url,
                 voice_id,
-                json.dumps([str(p) for p in narrations.values()])
+                json_text([str(p) for p in narrations.values()])
             ))
             
             await db.execute(
                 "UPDATE properties SET has_tour = 1 WHERE id = ?",
                 (property_id,)
             )
-            
-            await db.commit()
+        invalidate_property(property_id)
         
         logger.info(f"Narrated tour completed for property {property_id}")
         
@@ -972,7 +1346,7 @@ def generate_narrated_tour_html(
     outro_audio: Path = None
 ) -> str:
     """Generate HTML for narrated 360° tour"""
-    scenes_json = json.dumps(scenes)
+    scenes_json = json_text(scenes)
     intro_url = f"/tours/{tour_id}/audio/{intro_audio.name}" if intro_audio else ""
     outro_url = f"/tours/{tour_id}/audio/{outro_audio.name}" if outro_audio else ""
     
@@ -1193,66 +1567,52 @@ async def check_voice_quota():
     return quota
 # Analytics
 @api_router.get("/properties/{property_id}/analytics")
-async def get_property_analytics(property_id: str):
+async def get_property_analytics(property_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Get analytics for a property"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT * FROM analytics WHERE property_id = ?",
-            (property_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if not row:
-                return {
-                    "property_id": property_id, "views": 0, "shares": 0,
-                    "engagement_rate": 0.0, "viral_score": 0, "tour_views": 0
-                }
-            
+    async with db.execute(
+        """SELECT property_id, views, shares, engagement_rate, viral_score,
+                  tour_views, trending_status
+           FROM analytics WHERE property_id = ?""",
+        (property_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if not row:
             return {
-                "property_id": row[1], "views": row[2], "shares": row[3],
-                "engagement_rate": row[4], "viral_score": row[5],
-                "tour_views": row[6], "trending_status": row[7]
+                "property_id": property_id, "views": 0, "shares": 0,
+                "engagement_rate": 0.0, "viral_score": 0, "tour_views": 0
             }
 
+        return dict(row)
+
 @api_router.get("/dashboard/{user_id}")
-async def get_dashboard(user_id: str):
+async def get_dashboard(user_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Get user dashboard statistics"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT id, has_tour FROM properties WHERE user_id = ?",
-            (user_id,)
-        ) as cursor:
-            properties = await cursor.fetchall()
-        
-        total_properties = len(properties)
-        total_views = 0
-        total_shares = 0
-        total_tour_views = 0
-        properties_with_tours = sum(1 for p in properties if p[1])
-        
-        for prop in properties:
-            async with db.execute(
-                "SELECT views, shares, tour_views FROM analytics WHERE property_id = ?",
-                (prop[0],)
-            ) as cursor:
-                analytics = await cursor.fetchone()
-                if analytics:
-                    total_views += analytics[0]
-                    total_shares += analytics[1]
-                    total_tour_views += analytics[2]
-        
-        avg_engagement = (total_shares / total_views * 100) if total_views > 0 else 0
-        
-        return {
-            "user_id": user_id,
-            "statistics": {
-                "total_properties": total_properties,
-                "properties_with_tours": properties_with_tours,
-                "total_views": total_views,
-                "total_shares": total_shares,
-                "total_tour_views": total_tour_views,
-                "avg_engagement_rate": round(avg_engagement, 2)
-            }
+    async with db.execute("""
+        SELECT COUNT(p.id),
+               COALESCE(SUM(p.has_tour), 0),
+               COALESCE(SUM(a.views), 0),
+               COALESCE(SUM(a.shares), 0),
+               COALESCE(SUM(a.tour_views), 0)
+        FROM properties p
+        LEFT JOIN analytics a ON a.property_id = p.id
+        WHERE p.user_id = ?
+    """, (user_id,)) as cursor:
+        (total_properties, properties_with_tours,
+         total_views, total_shares, total_tour_views) = await cursor.fetchone()
+
+    avg_engagement = (total_shares / total_views * 100) if total_views > 0 else 0
+
+    return {
+        "user_id": user_id,
+        "statistics": {
+            "total_properties": total_properties,
+            "properties_with_tours": properties_with_tours,
+            "total_views": total_views,
+            "total_shares": total_shares,
+            "total_tour_views": total_tour_views,
+            "avg_engagement_rate": round(avg_engagement, 2)
         }
+    }
 
 
 @api_router.get("/platforms")
@@ -1268,15 +1628,22 @@ async def get_platforms_status():
     """Get detailed status of all platform integrations"""
     return platform_manager.get_platform_status()
 
+def catalogue_response(request: Request, payload: bytes, etag: str) -> Response:
+    """Serve a pre-encoded catalogue, or 304 when the client already has it"""
+    headers = {"ETag": etag, "Cache-Control": CATALOGUE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(payload, media_type="application/json", headers=headers)
+
 @api_router.get("/space-types")
-async def get_space_types():
+async def get_space_types(request: Request):
     """Get all available space types organized by category"""
-    return SPACE_TYPES
+    return catalogue_response(request, SPACE_TYPES_JSON, SPACE_TYPES_ETAG)
 
 @api_router.get("/standard-amenities")
-async def get_standard_amenities():
+async def get_standard_amenities(request: Request):
     """Get all standard amenities organized by category"""
-    return STANDARD_AMENITIES
+    return catalogue_response(request, STANDARD_AMENITIES_JSON, STANDARD_AMENITIES_ETAG)
 
 api_router.post("/properties/{property_id}/upload-room-360")
 async def upload_room_with_enhancement(
@@ -1294,14 +1661,13 @@ async def upload_room_with_enhancement(
     upload_path = UPLOADS_DIR / f"{room_id}_{file.filename}"
     
     # Save uploaded file
-    with open(upload_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    await asyncio.to_thread(save_upload, file, upload_path)
     
     # AI Enhancement if requested
     if enhance:
         try:
-            enhanced_path = ai_enhancer.enhance_real_estate_photo(
+            enhanced_path = await asyncio.to_thread(
+                ai_enhancer.enhance_real_estate_photo,
                 upload_path,
                 output_path=upload_path.parent / f"{room_id}_enhanced.jpg",
                 enhancement_level="standard"
@@ -1311,7 +1677,7 @@ async def upload_room_with_enhancement(
             logger.error(f"Enhancement failed: {e}")
     
     # Validate 360 image
-    is_valid, message = Tour360Processor.validate_360_image(str(upload_path))
+    is_valid, message = await asyncio.to_thread(Tour360Processor.validate_360_image, str(upload_path))
     if not is_valid:
         upload_path.unlink()
         raise HTTPException(400, message)
@@ -1339,49 +1705,27 @@ async def generate_complete_tour(
     rooms: list = Body(...),
     voice_narration: bool = True,
     add_music: bool = True,
-    property_type: str = "house"
+    property_type: str = "house",
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
     """Generate complete professional tour with narration and music"""
-    
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Get property data
-        async with db.execute(
-            "SELECT * FROM properties WHERE id = ?", (property_id,)
-        ) as cursor:
-            prop_row = await cursor.fetchone()
-            if not prop_row:
-                raise HTTPException(404, "Property not found")
-            
-            property_data = {
-                'id': prop_row[0],
-                'title': prop_row[2],
-                'description': prop_row[3],
-                'address': prop_row[4],
-                'price': prop_row[5],
-                'property_type': prop_row[6],
-                'bedrooms': prop_row[7],
-                'bathrooms': prop_row[8],
-                'square_feet': prop_row[9]
-            }
-        
-        # Get all room data from database
-        room_ids = [r['imageId'] for r in rooms]
-        room_data = []
-        
-        for room_id in room_ids:
-            async with db.execute(
-                "SELECT * FROM rooms WHERE id = ?", (room_id,)
-            ) as cursor:
-                room_row = await cursor.fetchone()
-                if room_row:
-                    room_data.append({
-                        'id': room_row[0],
-                        'space_name': room_row[2],
-                        'space_type': room_row[3],
-                        'space_category': room_row[4],
-                        'description': room_row[5],
-                        'image_360_url': room_row[7]
-                    })
+
+    # Get property data
+    property_data = await load_property(db, property_id)
+    if not property_data:
+        raise HTTPException(404, "Property not found")
+
+    # Get all room data from database
+    # One statement for any number of rooms; json_each keeps the requested order
+    room_ids = json_text([r['imageId'] for r in rooms])
+    room_rows = await db.execute_fetchall(
+        """SELECT r.id, r.space_name, r.space_type, r.space_category, r.description, r.image_360_url
+           FROM json_each(?) AS j
+           JOIN rooms r ON r.id = j.value
+           ORDER BY j.key""",
+        (room_ids,)
+    )
+    room_data = [dict(row) for row in room_rows]
     
     # Start background processing
     background_tasks.add_task(
@@ -1466,30 +1810,14 @@ async def process_complete_tour_background(
         )
         
         html_path = tour_dir / "tour.html"
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(tour_html)
+        await asyncio.to_thread(html_path.write_text, tour_html, encoding='utf-8')
         
         tour_url = f"/tours/{property_id}/tour.html"
         
         # Update database
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with app.state.pool.writer() as db:
             tour_id = str(uuid.uuid4())
             
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS complete_tours (
-                    id TEXT PRIMARY KEY,
-                    property_id TEXT NOT NULL,
-                    tour_url TEXT,
-                    voice_enabled BOOLEAN,
-                    music_enabled BOOLEAN,
-                    total_scenes INTEGER,
-                    property_type TEXT,
-                    status TEXT DEFAULT 'completed',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (property_id) REFERENCES properties (id)
-                )
-            """)
-            
             await db.execute("""
                 INSERT INTO complete_tours 
                 (id, property_id, tour_url, voice_enabled, music_enabled, 
@@ -1509,8 +1837,7 @@ async def process_complete_tour_background(
                 "UPDATE properties SET has_tour = 1 WHERE id = ?",
                 (property_id,)
             )
-            
-            await db.commit()
+        invalidate_property(property_id)
         
         logger.info(f"Complete professional tour generated: {property_id}")
         
@@ -1527,7 +1854,7 @@ def generate_professional_tour_html(
 ) -> str:
     """Generate professional HTML tour with all features"""
     
-    scenes_json = json.dumps(scenes)
+    scenes_json = json_text(scenes)
     intro_url = f"/tours/{property_id}/audio/{intro_audio.name}" if intro_audio else ""
     outro_url = f"/tours/{property_id}/audio/{outro_audio.name}" if outro_audio else ""
     
@@ -1983,92 +2310,61 @@ def generate_professional_tour_html(
 
 # Add tour analytics endpoint
 @api_router.get("/properties/{property_id}/tour-analytics")
-async def get_tour_analytics(property_id: str):
+async def get_tour_analytics(property_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Get analytics for property tour"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("""
-            SELECT COUNT(*) as views, 
-                   AVG(CAST(strftime('%s', 'now') - strftime('%s', created_at) AS REAL)) as avg_duration
-            FROM tour_views 
-            WHERE property_id = ?
-        """, (property_id,)) as cursor:
-            row = await cursor.fetchone()
-            return {
-                "total_views": row[0] if row else 0,
-                "avg_duration_seconds": row[1] if row else 0
-            }
+    async with db.execute("""
+        SELECT COUNT(*) as views,
+               AVG(CAST(strftime('%s', 'now') - strftime('%s', created_at) AS REAL)) as avg_duration
+        FROM tour_views
+        WHERE property_id = ?
+    """, (property_id,)) as cursor:
+        row = await cursor.fetchone()
+        return {
+            "total_views": row[0] if row else 0,
+            "avg_duration_seconds": row[1] if row else 0
+        }
 
 # ============================================================================
 # PLATFORM INTEGRATION ENDPOINTS
 # ============================================================================
 
-async def get_standard_amenities():
-    """Get all standard amenities organized by category"""
-    return STANDARD_AMENITIES
-
-@api_router.get("/health")
-
 @api_router.post("/properties/{property_id}/generate-video-tour")
 async def generate_video_tour(
     property_id: str,
     background_tasks: BackgroundTasks,
-    voice_provider: str = "edge-tts",  # or elevenlabs
-    voice_id: str = "professional_female",
-    music_genre: str = "upbeat",
-    export_social: bool = True,
-    agent_name: Optional[str] = None,
-    agent_phone: Optional[str] = None,
-    agent_email: Optional[str] = None,
-    logo_path: Optional[str] = None
+    params: VideoTourParams = Depends(),
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
     """Generate professional narrated video tour with music"""
-    
+
     # Get property and rooms
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT * FROM properties WHERE id = ?", (property_id,)
-        ) as cursor:
-            prop_row = await cursor.fetchone()
-            if not prop_row:
-                raise HTTPException(404, "Property not found")
-            
-            property_data = {
-                'id': prop_row[0], 'title': prop_row[2],
-                'description': prop_row[3], 'address': prop_row[4],
-                'price': prop_row[5], 'property_type': prop_row[6],
-                'bedrooms': prop_row[7], 'bathrooms': prop_row[8],
-                'square_feet': prop_row[9],
-                'features': json.loads(prop_row[10] or '[]')
-            }
-        
-        async with db.execute(
-            """SELECT * FROM rooms 
-               WHERE property_id = ? AND processing_status = 'completed' 
-               ORDER BY sort_order""",
-            (property_id,)
-        ) as cursor:
-            room_rows = await cursor.fetchall()
-            if not room_rows:
-                raise HTTPException(400, "No completed rooms with images found")
-            
-            rooms = [{
-                'id': r[0], 'space_name': r[2], 'space_type': r[3],
-                'space_category': r[4], 'description': r[5],
-                'image_360_url': r[7]
-            } for r in room_rows]
+    property_data = await load_property(db, property_id)
+    if not property_data:
+        raise HTTPException(404, "Property not found")
+
+    room_rows = await db.execute_fetchall(
+        f"""SELECT {SCENE_COLS} FROM rooms
+           WHERE property_id = ? AND processing_status = 'completed'
+           ORDER BY sort_order""",
+        (property_id,)
+    )
+    if not room_rows:
+        raise HTTPException(400, "No completed rooms with images found")
+
+    rooms = [dict(r) for r in room_rows]
     
     # Configure video generation
     video_config = VideoConfig(
-        voice_provider=voice_provider,
-        voice_id=voice_id,
-        music_genre=music_genre
+        voice_provider=params.voice_provider,
+        voice_id=params.voice_id,
+        music_genre=params.music_genre
     )
     
     branding_config = BrandingConfig(
-        agent_name=agent_name or "",
-        phone=agent_phone or "",
-        email=agent_email or "",
-        logo_path=logo_path
+        agent_name=params.agent_name or "",
+        phone=params.agent_phone or "",
+        email=params.agent_email or "",
+        logo_path=params.logo_path
     )
     
     # Start generation in background
@@ -2079,7 +2375,7 @@ async def generate_video_tour(
         rooms,
         video_config,
         branding_config,
-        export_social
+        params.export_social
     )
     
     return {
@@ -2103,71 +2399,60 @@ async def generate_video_background(
             property_id, property_data, rooms, config, branding, export_social
         )
         
+        if not result['success']:
+            logger.error(f"Video generation failed: {result.get('error')}")
+            return
+        
+        # Scripts and exports can be large, so encode them off the event loop
+        script_json, social_json = await asyncio.gather(
+            asyncio.to_thread(json_text, result.get('script', {})),
+            asyncio.to_thread(json_text, result.get('social_exports', {}))
+        )
+        
         # Update database with video info
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            if result['success']:
-                await db.execute("""
-                    UPDATE properties 
-                    SET has_tour = 1 
-                    WHERE id = ?
-                """, (property_id,))
-                
-                # Store video metadata
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS video_tours (
-                        id TEXT PRIMARY KEY,
-                        property_id TEXT NOT NULL,
-                        video_url TEXT,
-                        duration_seconds INTEGER,
-                        script TEXT,
-                        social_exports TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (property_id) REFERENCES properties (id)
-                    )
-                """)
-                
-                await db.execute("""
-                    INSERT INTO video_tours 
-                    (id, property_id, video_url, duration_seconds, script, social_exports)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    str(uuid.uuid4()),
-                    property_id,
-                    result['video_url'],
-                    result.get('duration_seconds', 0),
-                    json.dumps(result.get('script', {})),
-                    json.dumps(result.get('social_exports', {}))
-                ))
-                
-                await db.commit()
-                logger.info(f"Video tour completed for {property_id}")
-            else:
-                logger.error(f"Video generation failed: {result.get('error')}")
+        # Flag the property and store video metadata in one transaction
+        async with app.state.pool.writer() as db:
+            await db.execute("""
+                UPDATE properties 
+                SET has_tour = 1 
+                WHERE id = ?
+            """, (property_id,))
+            
+            await db.execute("""
+                INSERT INTO video_tours 
+                (id, property_id, video_url, duration_seconds, script, social_exports)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                str(uuid.uuid4()),
+                property_id,
+                result['video_url'],
+                result.get('duration_seconds', 0),
+                script_json,
+                social_json
+            ))
+        invalidate_property(property_id)
+        logger.info(f"Video tour completed for {property_id}")
                 
     except Exception as e:
         logger.error(f"Video background task failed: {e}", exc_info=True)
 
 @api_router.get("/properties/{property_id}/video-tour")
-async def get_video_tour(property_id: str):
+async def get_video_tour(property_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Get video tour info for a property"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute(
-            "SELECT * FROM video_tours WHERE property_id = ? ORDER BY created_at DESC LIMIT 1",
-            (property_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if not row:
-                raise HTTPException(404, "No video tour found")
-            
-            return {
-                'id': row[0],
-                'property_id': row[1],
-                'video_url': row[2],
-                'duration_seconds': row[3],
-                'script': json.loads(row[4]),
-                'social_exports': json.loads(row[5]),
-                'created_at': row[6]
-            }
+    async with db.execute(
+        """SELECT id, property_id, video_url, duration_seconds, script, social_exports, created_at
+           FROM video_tours WHERE property_id = ? ORDER BY created_at DESC LIMIT 1""",
+        (property_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(404, "No video tour found")
+
+        return {
+            **dict(row),
+            'script': orjson.loads(row['script']),
+            'social_exports': orjson.loads(row['social_exports'])
+        }
 
 @api_router.post("/api/properties/{property_id}/generate-viral-content")
 async def generate_viral_content(
@@ -2176,18 +2461,12 @@ async def generate_viral_content(
     voice: Optional[str] = 'professional_female'
 ):
     """Generate AI-powered viral social media content"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT * FROM properties WHERE id = ?", (property_id,)) as cursor:
-            row = await cursor.fetchone()
-            if not row:
-                raise HTTPException(404, "Property not found")
-            property_data = {
-                'id': row[0], 'title': row[2], 'description': row[3], 'address': row[4],
-                'price': row[5], 'property_type': row[6], 'bedrooms': row[7],
-                'bathrooms': row[8], 'square_feet': row[9],
-                'features': json.loads(row[10] or '[]'), 'has_tour': bool(row[11])
-            }
-    
+    # Return the reader before the slow AI calls
+    async with app.state.pool.reader() as db:
+        property_data = await load_property(db, property_id)
+    if not property_data:
+        raise HTTPException(404, "Property not found")
+
     if not platforms:
         platforms = ["instagram", "tiktok", "facebook", "twitter"]
     
@@ -2195,29 +2474,26 @@ async def generate_viral_content(
         content_results = await viral_content_engine.generate_batch_content(property_data, platforms, voice=voice)
         viral_contents = []
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute("""CREATE TABLE IF NOT EXISTS viral_content (
-                id TEXT PRIMARY KEY, property_id TEXT NOT NULL, platform TEXT NOT NULL,
-                content_type TEXT NOT NULL, content TEXT NOT NULL, viral_score INTEGER NOT NULL,
-                hashtags TEXT, ai_generated BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (property_id) REFERENCES properties (id))""")
+        rows = []
+        
+        for platform, content_data in content_results.items():
+            viral_content_id = str(uuid.uuid4())
+            rows.append(
+                (viral_content_id, property_id, platform, content_data.get('content_type', 'caption'),
+                 content_data['content'], content_data['viral_score'], 
+                 json_text(content_data['hashtags']), content_data.get('ai_generated', True)))
             
-            for platform, content_data in content_results.items():
-                viral_content_id = str(uuid.uuid4())
-                await db.execute(
-                    """INSERT INTO viral_content (id, property_id, platform, content_type, content, 
-                       viral_score, hashtags, ai_generated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (viral_content_id, property_id, platform, content_data.get('content_type', 'caption'),
-                     content_data['content'], content_data['viral_score'], 
-                     json.dumps(content_data['hashtags']), content_data.get('ai_generated', True)))
-                
-                viral_contents.append({
-                    'id': viral_content_id, 'property_id': property_id, 'platform': platform,
-                    'content': content_data['content'], 'viral_score': content_data['viral_score'],
-                    'hashtags': content_data['hashtags'], 'ai_generated': content_data.get('ai_generated', True)
-                })
-            await db.commit()
+            viral_contents.append({
+                'id': viral_content_id, 'property_id': property_id, 'platform': platform,
+                'content': content_data['content'], 'viral_score': content_data['viral_score'],
+                'hashtags': content_data['hashtags'], 'ai_generated': content_data.get('ai_generated', True)
+            })
+        
+        async with app.state.pool.writer() as db:
+            await db.executemany(
+                """INSERT INTO viral_content (id, property_id, platform, content_type, content, 
+                   viral_score, hashtags, ai_generated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows)
         
         return {"message": "Viral content generated", "content": viral_contents, "ai_enabled": viral_content_engine.enabled}
     except Exception as e:
@@ -2225,23 +2501,30 @@ async def generate_viral_content(
         raise HTTPException(500, f"Failed: {str(e)}")
 
 @api_router.get("/api/properties/{property_id}/viral-content")
-async def get_viral_content(property_id: str):
+async def get_viral_content(property_id: str, db: aiosqlite.Connection = Depends(get_read_db)):
     """Get all viral content"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        async with db.execute("SELECT * FROM viral_content WHERE property_id = ? ORDER BY created_at DESC", (property_id,)) as cursor:
-            rows = await cursor.fetchall()
-            return [{'id': r[0], 'property_id': r[1], 'platform': r[2], 'content_type': r[3],
-                    'content': r[4], 'viral_score': r[5], 'hashtags': json.loads(r[6] or '[]'),
-                    'ai_generated': bool(r[7]), 'created_at': r[8]} for r in rows]
+    rows = await db.execute_fetchall(
+        """SELECT id, property_id, platform, content_type, content, viral_score, hashtags,
+                  ai_generated, created_at
+           FROM viral_content WHERE property_id = ? ORDER BY created_at DESC""",
+        (property_id,)
+    )
+    return [{**dict(r), 'hashtags': orjson.loads(r['hashtags'] or '[]'),
+             'ai_generated': bool(r['ai_generated'])} for r in rows]
 
 @api_router.get("/voice-options")
 async def get_voice_options():
     """Get available voice options for video tours"""
     return premium_video_generator.voice_engine.voices
 
-async def health_check():
-    return {"status": "healthy", "version": "2.0.0-professional"}
-
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=WEB_WORKERS,
+        loop="uvloop",
+        http="httptools",
+        access_log=False
+    )
@@ -0,0 +1,25 @@
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_tour_view_post_is_buffered(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "DATABASE_PATH", tmp_path / "listingspark.db")
+    recorded = []
+    monkeypatch.setattr(server, "record_tour_view", recorded.append)
+
+    with TestClient(server.app) as client:
+        with sqlite3.connect(server.DATABASE_PATH) as db:
+            db.execute(
+                "INSERT INTO tours (id, property_id, tour_name) VALUES ('tour-1', 'prop-1', 'Tour')"
+            )
+
+        # Same path the generated tour page posts to
+        response = client.post("/api/tours/tour-1/view")
+        assert response.status_code == 202
+        assert recorded == ["tour-1"]
+
+        assert client.post("/api/tours/missing/view").status_code == 404
+        assert recorded == ["tour-1"]